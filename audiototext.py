@@ -4,14 +4,28 @@ import tempfile
 import threading
 import asyncio
 import uuid
-from datetime import timedelta
+import bisect
+import contextlib
+import functools
+import gc
+import logging
+from collections import OrderedDict
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import numpy as np
 import torch
 from fastapi import FastAPI, UploadFile, HTTPException, Form, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import whisperx
+from whisperx.audio import N_SAMPLES, log_mel_spectrogram
 from deep_translator import GoogleTranslator
+from cachetools import TTLCache
+
+logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI()
 
@@ -21,12 +35,27 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 app.mount("/static", StaticFiles(directory="frontend"), name="static")
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-COMPUTE_TYPE = "float16" if DEVICE == "cuda" else "float32"
 HF_TOKEN = os.getenv("HF_TOKEN", None)
+SAMPLE_RATE = 16000
+
+
+def detect_compute_type(device):
+    # Backend faster-whisper (CTranslate2): INT8 com ativações FP16 em GPUs com
+    # Tensor Cores (compute capability >= 7), FP16 em GPUs mais antigas e INT8 na CPU.
+    if device != "cuda":
+        return "int8"
+    major, _minor = torch.cuda.get_device_capability()
+    return "int8_float16" if major >= 7 else "float16"
+
+
+COMPUTE_TYPE = detect_compute_type(DEVICE)
+# Uma cópia de cada modelo por GPU visível; requisições distribuídas em rodízio.
+DEVICES = [f"cuda:{i}" for i in range(torch.cuda.device_count())] if DEVICE == "cuda" else ["cpu"]
 
 LANG_MAP = {
     "pt": "pt",
@@ -34,43 +63,183 @@ LANG_MAP = {
     "jp": "ja",
 }
 
+# Modelos mantidos em memória por GPU; os menos usados recentemente são descartados.
+MAX_MODELS_PER_DEVICE = 2
+MAX_ALIGN_MODELS_PER_DEVICE = 4
+
+# Limiares do VAD que remove trechos sem fala antes do encoder.
+VAD_OPTIONS = {"vad_onset": 0.500, "vad_offset": 0.363}
+
 QUALITY_CONFIG = {
-    "rapido": {"model": "small", "batch_size": 16, "align": False},
-    "bom": {"model": "medium", "batch_size": 8, "align": True},
-    "perfeito": {"model": "large-v2", "batch_size": 4, "align": True},
+    # compute_type None usa o padrão detectado para o dispositivo.
+    # asr_options: opções de decodificação do faster-whisper (beam search etc.).
+    "rapido": {
+        "model": "small",
+        "batch_size": 16,
+        "align": False,
+        "compute_type": "int8",
+        "asr_options": {"beam_size": 1, "condition_on_previous_text": False},
+    },
+    "bom": {
+        "model": "medium",
+        "batch_size": 8,
+        "align": True,
+        "compute_type": None,
+        "asr_options": {"beam_size": 2},
+    },
+    "perfeito": {
+        "model": "large-v2",
+        "batch_size": 4,
+        "align": True,
+        "compute_type": None,
+        "asr_options": {"beam_size": 5},
+    },
 }
 
 
+def use_gpu_features(model, device):
+    """
+    Substitui o preprocess do pipeline do WhisperX para calcular o log-mel
+    (STFT + filtros mel) na GPU. As features voltam para a CPU porque o
+    encoder do CTranslate2 recebe arrays numpy.
+    """
+    n_mels = model.model.feat_kwargs.get("feature_size") or 80
+
+    def preprocess(inputs):
+        audio = inputs["inputs"]
+        features = log_mel_spectrogram(
+            audio,
+            n_mels=n_mels,
+            padding=N_SAMPLES - audio.shape[0],
+            device=device,
+        )
+        return {"inputs": features.cpu()}
+
+    model.preprocess = preprocess
+    return model
+
+
+def compile_align_model(model_a, device):
+    """
+    Compila o modelo de alinhamento (wav2vec2) com torch.compile e roda uma
+    passada de aquecimento, para que erros de compilação (ex.: sem Triton no
+    Windows) apareçam no carregamento. Em caso de falha, usa o modelo original.
+    dynamic=True: cada segmento tem um tamanho diferente; evita recompilar
+    (e capturar um CUDA graph) por tamanho.
+    """
+    try:
+        compiled = torch.compile(model_a, dynamic=True)
+        with torch.inference_mode():
+            compiled(torch.zeros(1, SAMPLE_RATE, device=device))
+        return compiled
+    except Exception as err:
+        logger.warning("torch.compile do modelo de alinhamento falhou; usando modo eager: %s", err)
+        return model_a
+
+
 class WhisperXRuntime:
     def __init__(self):
         self.device = DEVICE
+        self.devices = DEVICES
         self.compute_type = COMPUTE_TYPE
-        self._models = {}
+        self._models = OrderedDict()
         self._model_lock = threading.Lock()
-        self._align_models = {}
+        self._align_models = OrderedDict()
         self._align_lock = threading.Lock()
+        # Um lock por chave de cache: o carregamento (lento) de um modelo não
+        # bloqueia o acesso a outros modelos/GPUs já carregados.
+        self._key_locks = {}
+        self._key_locks_lock = threading.Lock()
+        # O modelo de alinhamento compilado é compartilhado entre threads e a
+        # recompilação do Dynamo não é thread-safe: uma chamada por GPU por vez.
+        self._align_run_locks = {device: threading.Lock() for device in self.devices}
         self._diarize_pipeline = None
         self._diarize_lock = threading.Lock()
-
-    def get_model(self, model_name):
-        with self._model_lock:
-            if model_name not in self._models:
-                self._models[model_name] = whisperx.load_model(
-                    model_name,
-                    self.device,
-                    compute_type=self.compute_type,
-                    language="pt",
-                )
-            return self._models[model_name]
-
-    def get_align_model(self, language_code):
-        with self._align_lock:
-            if language_code not in self._align_models:
-                self._align_models[language_code] = whisperx.load_align_model(
-                    language_code=language_code,
-                    device=self.device,
-                )
-            return self._align_models[language_code]
+        # GoogleTranslator guarda estado da requisição na instância: um
+        # dicionário {(source, target): translator} por thread.
+        self._translators = threading.local()
+        self._streams = threading.local()
+
+    def _evict(self, cache, maxsize):
+        # Chaves terminam no dispositivo; o limite vale por GPU.
+        evicted_devices = set()
+        for device in self.devices:
+            keys = [key for key in cache if key[-1] == device]
+            for key in keys[:max(len(keys) - maxsize, 0)]:
+                del cache[key]
+                evicted_devices.add(device)
+        if evicted_devices:
+            gc.collect()
+            if self.device == "cuda":
+                # empty_cache só libera o dispositivo corrente da thread.
+                for device in evicted_devices:
+                    with torch.cuda.device(device):
+                        torch.cuda.empty_cache()
+
+    def _key_lock(self, key):
+        with self._key_locks_lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get_model(self, model_name, compute_type=None, device=None, asr_options=None):
+        compute_type = compute_type or self.compute_type
+        device = device or self.devices[0]
+        asr_options = asr_options or {}
+        key = (model_name, compute_type, tuple(sorted(asr_options.items())), device)
+        with self._key_lock(key):
+            with self._model_lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+            # CTranslate2 recebe o tipo ("cuda") e o índice da GPU separados.
+            device_type, _, device_index = device.partition(":")
+            model = whisperx.load_model(
+                model_name,
+                device_type,
+                device_index=int(device_index or 0),
+                compute_type=compute_type,
+                language="pt",
+                vad_options=VAD_OPTIONS,
+                asr_options=asr_options,
+            )
+            if self.device == "cuda":
+                use_gpu_features(model, device)
+            with self._model_lock:
+                self._models[key] = model
+                self._evict(self._models, MAX_MODELS_PER_DEVICE)
+            return model
+
+    def get_align_model(self, language_code, device=None):
+        device = device or self.devices[0]
+        key = (language_code, device)
+        with self._key_lock(key):
+            with self._align_lock:
+                if key in self._align_models:
+                    self._align_models.move_to_end(key)
+                    return self._align_models[key]
+            model_a, metadata = whisperx.load_align_model(
+                language_code=language_code,
+                device=device,
+            )
+            if self.device == "cuda":
+                model_a = compile_align_model(model_a, device)
+            with self._align_lock:
+                self._align_models[key] = (model_a, metadata)
+                self._evict(self._align_models, MAX_ALIGN_MODELS_PER_DEVICE)
+            return model_a, metadata
+
+    @contextlib.contextmanager
+    def align_session(self, device):
+        """
+        Contexto para rodar whisperx.align na GPU: serializa o uso do modelo
+        compilado por dispositivo e liga TF32 nas multiplicações de matrizes
+        (Ampere+). O pyannote (VAD/diarização) desliga TF32 a cada inferência,
+        por isso a flag é religada aqui, a cada alinhamento.
+        """
+        with self._align_run_locks[device]:
+            if self.device == "cuda":
+                torch.backends.cuda.matmul.allow_tf32 = True
+            with self.cuda_stream(device):
+                yield
 
     def get_diarization_pipeline(self):
         if not HF_TOKEN:
@@ -81,68 +250,379 @@ class WhisperXRuntime:
             if self._diarize_pipeline is None:
                 self._diarize_pipeline = whisperx.DiarizationPipeline(
                     use_auth_token=HF_TOKEN,
-                    device=self.device,
+                    device=self.devices[0],
                 )
             return self._diarize_pipeline
 
+    def cuda_stream(self, device=None):
+        """
+        Contexto com um torch.cuda.Stream dedicado à thread atual (por GPU),
+        para que alinhamento/diarização de requisições diferentes não
+        serializem no stream padrão. Em CPU, não faz nada.
+        """
+        if self.device != "cuda":
+            return contextlib.nullcontext()
+        device = device or self.devices[0]
+        streams = getattr(self._streams, "by_device", None)
+        if streams is None:
+            streams = self._streams.by_device = {}
+        if device not in streams:
+            streams[device] = torch.cuda.Stream(device=device)
+        return torch.cuda.stream(streams[device])
+
+    def audio_to_device(self, audio, device=None):
+        """
+        Copia o áudio para o dispositivo via buffer em memória fixada (pinned),
+        com cópia assíncrona no stream atual. Em CPU, retorna o próprio array.
+        """
+        if self.device != "cuda":
+            return audio
+        pinned = torch.empty(len(audio), dtype=torch.float32, pin_memory=True)
+        pinned.numpy()[:] = audio
+        return pinned.to(device or self.devices[0], non_blocking=True)
+
+    def get_translator(self, source, target):
+        translators = getattr(self._translators, "by_pair", None)
+        if translators is None:
+            translators = self._translators.by_pair = {}
+        key = (source, target)
+        if key not in translators:
+            translators[key] = GoogleTranslator(source=source, target=target)
+        return translators[key]
+
+    def translate(self, source, target, text):
+        return _cached_translate(source, target, text)
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_translate(source, target, text):
+    # Exceções não são cacheadas: falhas de rede são refeitas na próxima vez.
+    return runtime.get_translator(source, target).translate(text)
+
+
+# Traduções são limitadas por rede: até 16 requisições simultâneas.
+# (GoogleTranslator.translate_batch apenas chama translate em sequência.)
+translation_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="translate")
+
+
+def translate_segments(segments, source, target):
+    """
+    Traduz o texto dos segmentos em paralelo, uma requisição por texto único.
+    Mantém o texto original dos segmentos cuja tradução falhar.
+    """
+    texts = {seg.get("text", "").strip() for seg in segments}
+    texts.discard("")
+
+    def translate_one(text_val):
+        try:
+            return runtime.translate(source, target, text_val)
+        except Exception:
+            # Mantém texto original se tradução falhar (rede/provedor).
+            return text_val
+
+    texts = list(texts)
+    translated = dict(zip(texts, translation_executor.map(translate_one, texts)))
+    for seg in segments:
+        text_val = seg.get("text", "").strip()
+        if text_val:
+            seg["text"] = translated[text_val]
+
 
 runtime = WhisperXRuntime()
-last_export_lock = threading.Lock()
-last_export_payload = None
+
+
+def warmup_models():
+    """
+    Carrega o modelo padrão, o alinhamento em pt e (se houver HF_TOKEN) a
+    diarização. O encoder roda uma vez sobre o log-mel de 30s de silêncio para
+    inicializar os kernels: via model.transcribe o VAD descartaria o silêncio
+    e o modelo nunca seria executado.
+    """
+    cfg = QUALITY_CONFIG["bom"]
+    for device in runtime.devices:
+        model = runtime.get_model(cfg["model"], cfg.get("compute_type"), device, cfg.get("asr_options"))
+        n_mels = model.model.feat_kwargs.get("feature_size") or 80
+        features = log_mel_spectrogram(np.zeros(N_SAMPLES, dtype=np.float32), n_mels=n_mels)
+        model.model.encode(features.numpy())
+        runtime.get_align_model("pt", device)
+    if HF_TOKEN:
+        runtime.get_diarization_pipeline()
+
+
+async def _warmup():
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, warmup_models)
+    except Exception as err:
+        # Falha no pré-carregamento não impede o servidor; carrega sob demanda.
+        logger.warning("Pré-carregamento dos modelos falhou: %s", err)
+
+
+app.add_event_handler("startup", _warmup)
+
+# Exportações por job_id (acessadas só no event loop, sem lock).
+EXPORTS = TTLCache(maxsize=256, ttl=3600)
 
 
 def format_srt_time(seconds_value):
-    total_ms = int(seconds_value * 1000)
-    td = timedelta(milliseconds=total_ms)
-    total_seconds = int(td.total_seconds())
-    hours = total_seconds // 3600
-    minutes = (total_seconds % 3600) // 60
-    seconds = total_seconds % 60
-    millis = total_ms % 1000
+    millis = int(seconds_value * 1000)
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    seconds, millis = divmod(millis, 1000)
     return f"{hours:02}:{minutes:02}:{seconds:02},{millis:03}"
 
 
-def build_output_text(segments, with_timestamp=False, with_speaker=False):
-    if with_timestamp:
-        lines = []
-        for idx, seg in enumerate(segments, start=1):
-            start = format_srt_time(float(seg.get("start", 0.0)))
-            end = format_srt_time(float(seg.get("end", seg.get("start", 0.0))))
-            text = seg.get("text", "").strip()
-            if with_speaker and seg.get("speaker"):
-                text = f"{seg['speaker']}: {text}"
-            lines.append(f"{idx}\n{start} --> {end}\n{text}\n")
-        return "\n".join(lines).strip()
-
-    texts = []
-    for seg in segments:
+def iter_output_text(segments, with_timestamp=False, with_speaker=False):
+    """
+    Gera o texto de saída (TXT ou SRT) em partes, um segmento por vez.
+    A última parte sai sem espaços finais, igual a build_output_text.
+    """
+    separator = "\n\n" if with_timestamp else " "
+    first = True
+    previous = None
+    for idx, seg in enumerate(segments, start=1):
         text = seg.get("text", "").strip()
-        if not text:
+        if not text and not with_timestamp:
             continue
-        if with_speaker and seg.get("speaker"):
-            texts.append(f"{seg['speaker']}: {text}")
-        else:
-            texts.append(text)
-    return " ".join(texts).strip()
-
-# Controle global (suporta UMA transcrição ativa de cada vez)
-current_task_lock = threading.Lock()
-current_stop_event = None  # threading.Event quando há uma transcrição ativa
-
-def convert_to_wav(input_path):
-    output_path = os.path.splitext(input_path)[0] + "_converted.wav"
-    (
-        ffmpeg.input(input_path)
-        .output(output_path, ac=1, ar=16000)
-        .overwrite_output()
-        .run(capture_stdout=True, capture_stderr=True)
-    )
-    return output_path
+        speaker = seg.get("speaker") if with_speaker else None
+        if speaker:
+            text = f"{speaker}: {text}"
+        if with_timestamp:
+            start_value = float(seg.get("start", 0.0))
+            start = format_srt_time(start_value)
+            end = format_srt_time(float(seg.get("end", start_value)))
+            text = f"{idx}\n{start} --> {end}\n{text}"
+        if previous is not None:
+            yield previous
+        previous = text if first else separator + text
+        first = False
+    if previous is not None:
+        yield previous.rstrip()
+
+
+def build_output_text(segments, with_timestamp=False, with_speaker=False):
+    buf = StringIO()
+    for piece in iter_output_text(segments, with_timestamp=with_timestamp, with_speaker=with_speaker):
+        buf.write(piece)
+    return buf.getvalue().strip()
+
+# Eventos de parada das transcrições ativas, por request_id (acionados por /stop)
+active_stop_events = {}
+
+# Limite de transcrições simultâneas; acima dele /transcribe responde 429.
+MAX_ACTIVE_TRANSCRIPTIONS = 8
+transcription_slots = asyncio.Semaphore(MAX_ACTIVE_TRANSCRIPTIONS)
+
+# Janela para agrupar requisições da mesma precisão em um único lote
+BATCH_WINDOW_S = 0.15
+# Silêncio entre clipes concatenados. Maior que o chunk de 30s do VAD do
+# WhisperX, garantindo que nenhum trecho enviado ao modelo misture dois clipes.
+BATCH_GAP_S = 31
+# Intervalo com que a thread da requisição verifica /stop enquanto aguarda o lote
+STOP_POLL_S = 0.1
+
+# Pool próprio para os lotes (um worker por dispositivo). As threads de
+# requisição ficam bloqueadas no executor padrão aguardando o lote; se o lote
+# usasse o mesmo pool, ele poderia esgotar e nunca executar.
+batch_executor = ThreadPoolExecutor(max_workers=len(DEVICES), thread_name_prefix="batch")
+
+# Dispositivos livres, compartilhados por todas as precisões: cada lote
+# retira uma GPU ao começar e a devolve ao terminar.
+_free_devices = None
+
+
+def free_devices():
+    # Criada sob demanda, já dentro do event loop.
+    global _free_devices
+    if _free_devices is None:
+        _free_devices = asyncio.Queue()
+        for device in DEVICES:
+            _free_devices.put_nowait(device)
+    return _free_devices
+
+
+def transcribe_batch(audios, cfg, device=None):
+    """
+    Transcreve vários áudios em uma única chamada ao modelo, concatenando-os
+    com silêncio entre eles. Retorna [(segments, language), ...] na mesma ordem.
+    """
+    model = runtime.get_model(cfg["model"], cfg.get("compute_type"), device, cfg.get("asr_options"))
+    if len(audios) == 1:
+        result = model.transcribe(audios[0], batch_size=cfg["batch_size"], language="pt")
+        return [(result.get("segments", []), result.get("language") or "pt")]
+
+    gap = np.zeros(BATCH_GAP_S * SAMPLE_RATE, dtype=np.float32)
+    pieces = []
+    offsets = []
+    position = 0
+    for audio in audios:
+        offsets.append(position / SAMPLE_RATE)
+        pieces.extend((audio, gap))
+        position += len(audio) + len(gap)
+
+    result = model.transcribe(np.concatenate(pieces), batch_size=cfg["batch_size"], language="pt")
+    language = result.get("language") or "pt"
+    per_clip = [[] for _ in audios]
+    for seg in result.get("segments", []):
+        start = float(seg.get("start", 0.0))
+        idx = max(bisect.bisect_right(offsets, start) - 1, 0)
+        shift = offsets[idx]
+        per_clip[idx].append(
+            dict(seg, start=start - shift, end=float(seg.get("end", start)) - shift)
+        )
+    return [(segments, language) for segments in per_clip]
+
+
+class TranscriptionBatcher:
+    """
+    Fila de uma precisão: um worker coleta as requisições que chegam dentro
+    de BATCH_WINDOW_S (até batch_size) e as transcreve em um único lote.
+    Cada lote roda em uma GPU livre, retirada de free_devices(); com várias
+    GPUs, lotes rodam ao mesmo tempo, nunca dois na mesma GPU.
+    """
+
+    def __init__(self, precision):
+        self.precision = precision
+        self._queue = None
+        self._worker = None
+        self._batches = set()
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_worker()
+        item["future"] = asyncio.get_running_loop().create_future()
+        await self._queue.put(item)
+        return await item["future"]
+
+    def _cancel_if_queued(self, item):
+        # Roda no loop: só descarta a requisição se o lote dela ainda não começou.
+        future = item["future"]
+        if not item["started"] and future is not None and not future.done():
+            future.cancel()
+
+    def transcribe(self, audio, loop, stop_event):
+        """
+        Chamado a partir do executor (thread); bloqueia até o lote terminar.
+        Se stop_event for acionado enquanto a requisição ainda aguarda na
+        fila, ela é descartada; se o lote já começou, aguarda o resultado
+        (retornado como parcial pelo chamador).
+        Retorna (segments, language, device), ou None quando descartada.
+        """
+        item = {"audio": audio, "future": None, "started": False}
+        pending = asyncio.run_coroutine_threadsafe(self.submit(item), loop)
+        while True:
+            try:
+                return pending.result(timeout=STOP_POLL_S)
+            except concurrent.futures.TimeoutError:
+                if stop_event.is_set():
+                    loop.call_soon_threadsafe(self._cancel_if_queued, item)
+            except concurrent.futures.CancelledError:
+                return None
+
+    async def _run(self):
+        cfg = QUALITY_CONFIG[self.precision]
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + BATCH_WINDOW_S
+            while len(items) < cfg["batch_size"]:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            device = await free_devices().get()
+            batch = asyncio.create_task(self._run_batch(items, cfg, device))
+            self._batches.add(batch)
+            batch.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, items, cfg, device):
+        loop = asyncio.get_running_loop()
+        try:
+            # Requisições interrompidas por /stop enquanto aguardavam; as
+            # restantes são marcadas como iniciadas e não podem mais ser descartadas.
+            items = [item for item in items if not item["future"].done()]
+            if not items:
+                return
+            for item in items:
+                item["started"] = True
+            try:
+                results = await loop.run_in_executor(
+                    batch_executor, transcribe_batch, [item["audio"] for item in items], cfg, device
+                )
+            except Exception as err:
+                for item in items:
+                    if not item["future"].done():
+                        item["future"].set_exception(err)
+                return
+            # Devolve também o dispositivo do lote: o alinhamento usa a mesma GPU.
+            for item, (segments, language) in zip(items, results):
+                if not item["future"].done():
+                    item["future"].set_result((segments, language, device))
+        finally:
+            free_devices().put_nowait(device)
+
+
+BATCHERS = {precision: TranscriptionBatcher(precision) for precision in QUALITY_CONFIG}
+
+def decode_audio(audio_bytes, suffix=".wav"):
+    """
+    Decodifica o áudio direto para memória (mono, 16 kHz, float32),
+    enviando os bytes do upload ao ffmpeg via stdin.
+    Formatos que exigem leitura com seek (ex.: mp4/m4a com moov no fim)
+    caem para um arquivo temporário.
+    """
+    output_kwargs = {"format": "f32le", "acodec": "pcm_f32le", "ac": 1, "ar": SAMPLE_RATE}
+    try:
+        out, _ = (
+            ffmpeg.input("pipe:0")
+            .output("pipe:1", **output_kwargs)
+            .run(input=audio_bytes, capture_stdout=True, capture_stderr=True)
+        )
+        if out:
+            return np.frombuffer(out, np.float32)
+    except ffmpeg.Error:
+        pass
+
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+            tmp.write(audio_bytes)
+            tmp_path = tmp.name
+        out, _ = (
+            ffmpeg.input(tmp_path)
+            .output("pipe:1", **output_kwargs)
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        return np.frombuffer(out, np.float32)
+    finally:
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+# Diarização só depende do áudio: roda em paralelo com transcrição/alinhamento.
+diarization_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="diarize")
+
+
+def diarize_audio(audio):
+    diarize = runtime.get_diarization_pipeline()
+    with runtime.cuda_stream():
+        return diarize(audio)
+
 
 def transcribe_with_cancel(
-    wav_path,
+    audio,
     stop_event,
-    with_timestamp=False,
+    loop,
     with_speaker=False,
     target_language="pt",
     precision="bom",
@@ -150,69 +630,66 @@ def transcribe_with_cancel(
     """
     Função executada em executor (thread). Itera sobre os segmentos e
     verifica stop_event a cada segmento.
-    Retorna (aborted_flag, text)
+    A transcrição passa pelo TranscriptionBatcher da precisão, no loop
+    informado.
+    O alinhamento roda na mesma GPU escolhida para a transcrição.
+    Retorna (aborted_flag, segments, detected_language); a montagem do
+    texto fica com o endpoint.
     """
-    cfg = QUALITY_CONFIG.get(precision, QUALITY_CONFIG["bom"])
-    audio = whisperx.load_audio(wav_path)
+    if precision not in QUALITY_CONFIG:
+        precision = "bom"
+    cfg = QUALITY_CONFIG[precision]
     if stop_event.is_set():
-        return True, "", [], "pt"
+        return True, [], "pt"
 
-    model = runtime.get_model(cfg["model"])
-    result = model.transcribe(
-        audio,
-        batch_size=cfg["batch_size"],
-        language="pt",
-    )
-    segments = result.get("segments", [])
-    detected_language = result.get("language") or "pt"
+    diarize_future = diarization_executor.submit(diarize_audio, audio) if with_speaker else None
+    try:
+        batched = BATCHERS[precision].transcribe(audio, loop, stop_event)
+        if batched is None:
+            return True, [], "pt"
+        segments, detected_language, device = batched
 
-    if stop_event.is_set():
-        partial_text = build_output_text(segments, with_timestamp=with_timestamp, with_speaker=False)
-        return True, partial_text, segments, detected_language
+        if stop_event.is_set():
+            return True, segments, detected_language
 
-    if segments and cfg["align"]:
-        try:
-            model_a, metadata = runtime.get_align_model(detected_language)
-            aligned = whisperx.align(
-                segments,
-                model_a,
-                metadata,
-                audio,
-                runtime.device,
-                return_char_alignments=False,
-            )
-            if isinstance(aligned, dict) and aligned.get("segments"):
-                segments = aligned["segments"]
-        except Exception:
-            # Se alinhamento falhar, retorna transcrição base.
-            pass
+        if segments and cfg["align"]:
+            try:
+                model_a, metadata = runtime.get_align_model(detected_language, device)
+                with runtime.align_session(device):
+                    aligned = whisperx.align(
+                        segments,
+                        model_a,
+                        metadata,
+                        runtime.audio_to_device(audio, device),
+                        device,
+                        return_char_alignments=False,
+                    )
+                if isinstance(aligned, dict) and aligned.get("segments"):
+                    segments = aligned["segments"]
+            except Exception:
+                # Se alinhamento falhar, retorna transcrição base.
+                pass
 
-    if with_speaker and segments:
-        try:
-            diarize = runtime.get_diarization_pipeline()
-            diarize_segments = diarize(audio)
-            speaker_assigned = whisperx.assign_word_speakers(diarize_segments, {"segments": segments})
-            if isinstance(speaker_assigned, dict) and speaker_assigned.get("segments"):
-                segments = speaker_assigned["segments"]
-        except Exception:
-            for seg in segments:
-                seg.setdefault("speaker", "NARRADOR")
-
-    target_code = LANG_MAP.get(target_language, "pt")
-    if target_code != detected_language and segments:
-        for seg in segments:
-            text_val = seg.get("text", "").strip()
-            if not text_val:
-                continue
+        if with_speaker and segments:
             try:
-                translator = GoogleTranslator(source_language=detected_language, target_language=target_code)
-                seg["text"] = translator.translate(text_val)
+                diarize_segments = diarize_future.result()
+                speaker_assigned = whisperx.assign_word_speakers(diarize_segments, {"segments": segments})
+                if isinstance(speaker_assigned, dict) and speaker_assigned.get("segments"):
+                    segments = speaker_assigned["segments"]
             except Exception:
-                # Mantém texto original se tradução falhar (rede/provedor).
-                seg["text"] = text_val
+                for seg in segments:
+                    seg.setdefault("speaker", "NARRADOR")
+
+        target_code = LANG_MAP.get(target_language, "pt")
+        if target_code != detected_language and segments:
+            translate_segments(segments, detected_language, target_code)
 
-    text = build_output_text(segments, with_timestamp=with_timestamp, with_speaker=with_speaker)
-    return stop_event.is_set(), text, segments, detected_language
+        return stop_event.is_set(), segments, detected_language
+    finally:
+        # Diarização não consumida (parada, sem segmentos, erro): cancela se
+        # ainda não começou, em vez de processar o arquivo inteiro à toa.
+        if diarize_future is not None and not diarize_future.done():
+            diarize_future.cancel()
 
 @app.post("/transcribe")
 async def transcribe(
@@ -221,61 +698,58 @@ async def transcribe(
     diferenciar_narrador: bool = Form(False),
     idioma: str = Form("pt"),
     precisao: str = Form("bom"),
+    request_id: str = Form(None),
 ):
-    global current_stop_event
-    # bloqueia para garantir apenas uma transcrição ativa
-    if not current_task_lock.acquire(blocking=False):
-        # já existe transcrição rodando
-        raise HTTPException(status_code=429, detail="Servidor ocupado com outra transcrição. Tente novamente.")
-
-    tmp_path = None
-    wav_path = None
+    if transcription_slots.locked():
+        raise HTTPException(status_code=429, detail="Servidor ocupado com outras transcrições. Tente novamente.")
+    await transcription_slots.acquire()
+
+    # cria Event para esta transcrição, identificado pelo request_id do cliente
+    request_id = request_id or str(uuid.uuid4())
+    stop_event = threading.Event()
+    active_stop_events[request_id] = stop_event
     try:
-        # cria Event para esta transcrição
-        stop_event = threading.Event()
-        current_stop_event = stop_event
-
-        # salva arquivo recebido
-        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(audio.filename)[1] or ".wav", delete=False) as tmp:
-            tmp.write(await audio.read())
-            tmp.flush()
-            tmp_path = tmp.name
-
-        wav_path = convert_to_wav(tmp_path)
+        # decodifica o arquivo recebido direto da memória, fora do loop async
+        # (ffmpeg é um subprocesso bloqueante)
+        loop = asyncio.get_running_loop()
+        audio_bytes = await audio.read()
+        suffix = os.path.splitext(audio.filename or "")[1] or ".wav"
+        audio_data = await loop.run_in_executor(None, decode_audio, audio_bytes, suffix)
 
         # executa transcrição em thread pool para não bloquear o loop async
-        loop = asyncio.get_running_loop()
-        aborted, text, segments, detected_language = await loop.run_in_executor(
+        aborted, segments, detected_language = await loop.run_in_executor(
             None,
             transcribe_with_cancel,
-            wav_path,
+            audio_data,
             stop_event,
-            timestamp,
+            loop,
             diferenciar_narrador,
             idioma,
             precisao,
         )
 
         job_id = str(uuid.uuid4())
-        txt_content = build_output_text(
+        text = build_output_text(
             segments,
-            with_timestamp=False,
+            with_timestamp=timestamp,
             with_speaker=diferenciar_narrador,
         )
-        srt_content = build_output_text(
-            segments,
-            with_timestamp=True,
-            with_speaker=diferenciar_narrador,
-        ) if timestamp else None
 
-        with last_export_lock:
-            global last_export_payload
-            last_export_payload = {
-                "job_id": job_id,
-                "txt": txt_content,
-                "srt": srt_content,
-                "srt_enabled": timestamp,
-            }
+        # Guarda só os campos usados na montagem (sem a lista "words" do
+        # alinhamento); TXT/SRT são montados sob demanda em /export.
+        EXPORTS[job_id] = {
+            "segments": [
+                {
+                    "start": seg.get("start", 0.0),
+                    "end": seg.get("end", seg.get("start", 0.0)),
+                    "text": seg.get("text", ""),
+                    "speaker": seg.get("speaker"),
+                }
+                for seg in segments
+            ],
+            "with_speaker": diferenciar_narrador,
+            "timestamp": timestamp,
+        }
 
         if aborted:
             return JSONResponse(
@@ -300,39 +774,48 @@ async def transcribe(
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Falha na transcrição: {err}")
     finally:
-        if tmp_path:
-            try:
-                os.remove(tmp_path)
-            except OSError:
-                pass
-        if wav_path:
-            try:
-                os.remove(wav_path)
-            except OSError:
-                pass
-        # libera lock para a próxima transcrição
-        if current_task_lock.locked():
-            current_task_lock.release()
-        current_stop_event = None
+        if active_stop_events.get(request_id) is stop_event:
+            del active_stop_events[request_id]
+        transcription_slots.release()
 
 @app.post("/stop")
-async def stop_processing():
+async def stop_processing(request_id: str = Form(...)):
     """
-    Endpoint chamado pelo frontend para interromper o processamento atual.
+    Endpoint chamado pelo frontend para interromper a transcrição
+    identificada por request_id (o mesmo enviado em /transcribe).
     """
-    global current_stop_event
-    if current_stop_event is None:
+    stop_event = active_stop_events.get(request_id)
+    if stop_event is None:
         return {"status": "no_active_task"}
-    current_stop_event.set()
+    stop_event.set()
     return {"status": "stopping"}
 
 
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunks(pieces):
+    """
+    Agrupa as partes de texto em blocos de ~EXPORT_CHUNK_SIZE bytes UTF-8.
+    """
+    buf = []
+    size = 0
+    for piece in pieces:
+        data = piece.encode("utf-8")
+        buf.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield b"".join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield b"".join(buf)
+
+
 @app.get("/export")
 async def export_transcription(job_id: str, formato: str = "txt"):
-    with last_export_lock:
-        data = last_export_payload
-
-    if data is None or data.get("job_id") != job_id:
+    data = EXPORTS.get(job_id)
+    if data is None:
         raise HTTPException(status_code=404, detail="Transcrição não encontrada para exportação.")
 
     fmt = formato.lower().strip()
@@ -340,18 +823,23 @@ async def export_transcription(job_id: str, formato: str = "txt"):
         raise HTTPException(status_code=400, detail="Formato inválido. Use txt ou srt.")
 
     if fmt == "srt":
-        if not data.get("srt_enabled") or not data.get("srt"):
+        if not data["timestamp"] or not data["segments"]:
             raise HTTPException(status_code=400, detail="SRT disponível apenas quando timestamp está ativado.")
-        content = data["srt"]
         media_type = "application/x-subrip"
         filename = f"transcricao_{job_id}.srt"
     else:
-        content = data.get("txt", "")
         media_type = "text/plain; charset=utf-8"
         filename = f"transcricao_{job_id}.txt"
 
-    return Response(
-        content=content,
+    # Gerador síncrono: o Starlette o consome em thread, montando o texto
+    # enquanto os blocos anteriores já são enviados.
+    pieces = iter_output_text(
+        data["segments"],
+        with_timestamp=(fmt == "srt"),
+        with_speaker=data["with_speaker"],
+    )
+    return StreamingResponse(
+        iter_chunks(pieces),
         media_type=media_type,
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
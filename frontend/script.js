@@ -11,6 +11,15 @@ const precisionTooltip = document.getElementById('precisionTooltip');
 
 let latestJobId = null;
 let latestExportSupportsSrt = false;
+// identifica a transcrição em andamento para que /stop interrompa só ela
+let currentRequestId = null;
+
+function generateRequestId() {
+  if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+    return window.crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
 
 // Tooltip interativo de precisão
 if (precisionInfoIcon && precisionTooltip) {
@@ -176,8 +185,10 @@ sendButton.addEventListener("click", async (e) => {
     // usuário pediu para parar: sinaliza frontend e backend
     stopSignal.done = true;                 // para o loader local
     try {
-      // pede ao backend para interromper o processamento atual
-      await fetch("/stop", { method: "POST" });
+      // pede ao backend para interromper esta transcrição
+      const stopData = new FormData();
+      stopData.append('request_id', currentRequestId || '');
+      await fetch("/stop", { method: "POST", body: stopData });
     } catch (err) {
       console.warn("Não foi possível contatar /stop:", err);
     }
@@ -224,6 +235,8 @@ async function sendAudio() {
   formData.append('diferenciar_narrador', String(narradorToggle.checked));
   formData.append('idioma', languageSelected ? languageSelected.value : 'pt');
   formData.append('precisao', precisionSelected ? precisionSelected.value : 'bom');
+  currentRequestId = generateRequestId();
+  formData.append('request_id', currentRequestId);
   latestJobId = null;
   latestExportSupportsSrt = false;
   updateExportButtonsState();
@@ -283,6 +296,7 @@ async function sendAudio() {
     addMessage(`Erro ao enviar áudio: ${err.message}`, "bot");
   } finally {
     // volta ícone pro normal
+    currentRequestId = null;
     setSendIconIsProcessing(false);
   }
 }